@@ -4,44 +4,110 @@ Handles password hashing, JWT token generation and validation
 """
 
 from datetime import datetime, timedelta
-from typing import Optional
-from jose import JWTError, jwt
+from typing import Optional, Union
+import base64
+import binascii
+import calendar
+import hashlib
+import hmac
+import json
+import threading
+import time
+import anyio
+from cachetools import TTLCache
+import jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import bindparam, select
+from sqlalchemy.ext.asyncio import AsyncSession
 import os
-from dotenv import load_dotenv
 
+from config import settings
 from database import get_db
 from models import User
 
-# Load environment variables
-load_dotenv()
-
 # JWT Configuration
-SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
-ALGORITHM = os.getenv("ALGORITHM", "HS256")
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+SECRET_KEY = settings.secret_key
+ALGORITHM = settings.algorithm
+ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
+
+# Fast-path HS256 codec for the tokens this service issues
+# Set JWT_FAST_PATH=false to always go through PyJWT
+JWT_FAST_PATH = ALGORITHM == "HS256" and settings.jwt_fast_path
+
+# Claims the fast path understands; tokens carrying anything else go to PyJWT
+_FAST_PATH_CLAIMS = frozenset({"sub", "uid", "exp"})
+
+# HMAC keyed once with SECRET_KEY; each token signs a copy of it
+_hmac_prototype = hmac.new(SECRET_KEY.encode(), digestmod=hashlib.sha256)
+
+# Password hashing configuration
+# BCRYPT_ROUNDS sets the bcrypt cost factor (each step doubles hashing time)
+# PASSWORD_SCHEME selects the scheme for new hashes ("bcrypt" or "argon2")
+BCRYPT_ROUNDS = settings.bcrypt_rounds
+PASSWORD_SCHEME = settings.password_scheme
 
-# Password hashing context using bcrypt
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing context
+# Hashes using any other scheme or cost are rehashed on the next successful login
+# (bcrypt__rounds only sets the cost of new hashes; the desired-rounds bounds
+# are what flag existing hashes with a different cost for an update)
+pwd_context = CryptContext(
+    schemes=[PASSWORD_SCHEME] + [s for s in ("bcrypt", "argon2") if s != PASSWORD_SCHEME],
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_desired_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_desired_rounds=BCRYPT_ROUNDS,
+    deprecated="auto"
+)
+
+# Hash verified when a login email is unknown, so every login costs one
+# password hash whether or not the user exists (no timing oracle)
+DUMMY_PASSWORD_HASH = pwd_context.hash("x" * 16)
+
+# Dedicated limiter for hashing work, sized to CPU count so bcrypt/argon2
+# cannot starve the shared threadpool. Created lazily because anyio needs
+# a running event loop to build it.
+_hash_limiter: Optional[anyio.CapacityLimiter] = None
+
+# Pre-built user lookup, bound per request (also used by login in routes)
+SEL_USER_BY_EMAIL = select(User).where(User.email == bindparam("email"))
 
 # HTTP Bearer token security
 security = HTTPBearer()
 
+# Cache of verified JWT payloads keyed by token hash
+# Entries live at most 60 seconds and never past the token's own expiry
+_jwt_cache = TTLCache(maxsize=10000, ttl=60)
+_jwt_cache_lock = threading.Lock()
+
+# Cache of authenticated user fields keyed by email
+# Saves a database round-trip per request for recently seen users
+_user_cache = TTLCache(maxsize=5000, ttl=30)
+_user_cache_lock = threading.Lock()
+
+
+def _truncate_password(password: str) -> Union[str, bytes]:
+    """
+    Limit a password to bcrypt's 72-byte input, cutting at exactly 72 bytes
+    - Applied identically at hash and verify time so both see the same secret
+    - ASCII strings have one byte per character, so skip the encode for them
+    Returns: The password, or its first 72 UTF-8 bytes if it was longer
+    """
+    if password.isascii():
+        return password[:72] if len(password) > 72 else password
+    encoded = password.encode("utf-8")
+    return encoded[:72] if len(encoded) > 72 else password
+
 
 def hash_password(password: str) -> str:
     """
-    Hash a plain text password using bcrypt
+    Hash a plain text password using PASSWORD_SCHEME
     Returns: Hashed password string
     """
     try:
         # Ensure password length is within bcrypt's 72-byte limit
-        if len(password.encode("utf-8")) > 72:
-            password = password[:72]
-
-        hashed = pwd_context.hash(password)
+        # (bcrypt >= 5 raises instead of truncating on its own)
+        hashed = pwd_context.hash(_truncate_password(password))
         return hashed
 
     except Exception as e:
@@ -57,7 +123,109 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     Verify a plain text password against a hashed password
     Returns: True if password matches, False otherwise
     """
-    return pwd_context.verify(plain_password, hashed_password)
+    return pwd_context.verify(_truncate_password(plain_password), hashed_password)
+
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    """
+    Verify a password and migrate its hash if the hashing policy changed
+    Returns: (verified, new_hash) where new_hash is None unless a rehash is needed
+    """
+    return pwd_context.verify_and_update(_truncate_password(plain_password), hashed_password)
+
+
+def _get_hash_limiter() -> anyio.CapacityLimiter:
+    """Return the shared capacity limiter for password hashing threads"""
+    global _hash_limiter
+    if _hash_limiter is None:
+        _hash_limiter = anyio.CapacityLimiter(os.cpu_count() or 1)
+    return _hash_limiter
+
+
+async def ahash_password(password: str) -> str:
+    """
+    Hash a password in a worker thread without blocking the event loop
+    Returns: Hashed password string
+    """
+    return await anyio.to_thread.run_sync(hash_password, password, limiter=_get_hash_limiter())
+
+
+async def averify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    """
+    Async variant of verify_and_update_password running in a worker thread
+    Returns: (verified, new_hash) where new_hash is None unless a rehash is needed
+    """
+    return await anyio.to_thread.run_sync(
+        verify_and_update_password, plain_password, hashed_password, limiter=_get_hash_limiter()
+    )
+
+
+def _b64url_encode(data: bytes) -> bytes:
+    """Base64url-encode without padding, as used by JWT"""
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _b64url_decode(data: bytes) -> bytes:
+    """Decode unpadded base64url data"""
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+
+# Header shared by every HS256 token (same bytes PyJWT produces)
+_HS256_HEADER_B64 = _b64url_encode(
+    json.dumps({"alg": "HS256", "typ": "JWT"}, separators=(",", ":")).encode()
+)
+
+
+def _hs256_signature(signing_input: bytes) -> bytes:
+    """Return the base64url HMAC-SHA256 signature for a JWT signing input"""
+    mac = _hmac_prototype.copy()
+    mac.update(signing_input)
+    return _b64url_encode(mac.digest())
+
+
+def _encode_hs256(payload: dict) -> str:
+    """
+    Encode a payload as an HS256 JWT using the precomputed header and key
+    Returns: Encoded JWT token string
+    """
+    payload_b64 = _b64url_encode(json.dumps(payload, separators=(",", ":")).encode())
+    signing_input = _HS256_HEADER_B64 + b"." + payload_b64
+    return (signing_input + b"." + _hs256_signature(signing_input)).decode()
+
+
+def _decode_hs256(token: str) -> Optional[dict]:
+    """
+    Verify and decode an HS256 JWT issued by this service
+    Returns: Decoded payload, or None if the token needs the full PyJWT path
+    Raises: jwt.PyJWTError if the token is malformed, forged or expired
+    """
+    raw = token.encode()
+    signing_input, _, signature = raw.rpartition(b".")
+    header_b64, _, payload_b64 = signing_input.partition(b".")
+
+    # Anything but our exact header (other alg, kid, ...) goes to PyJWT
+    if header_b64 != _HS256_HEADER_B64:
+        return None
+
+    if not hmac.compare_digest(_hs256_signature(signing_input), signature):
+        raise jwt.InvalidSignatureError("Signature verification failed")
+
+    try:
+        payload = json.loads(_b64url_decode(payload_b64))
+    except (binascii.Error, ValueError) as e:
+        raise jwt.DecodeError(f"Invalid payload: {e}")
+
+    if not isinstance(payload, dict) or not payload.keys() <= _FAST_PATH_CLAIMS:
+        return None
+
+    exp = payload.get("exp")
+    if exp is not None:
+        if not isinstance(exp, (int, float)):
+            raise jwt.DecodeError("Expiration Time claim (exp) must be a number")
+        if exp <= time.time():
+            raise jwt.ExpiredSignatureError("Signature has expired")
+
+    return payload
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -76,10 +244,12 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
 
-    # Add expiration to token payload
-    to_encode.update({"exp": expire})
+    # Add expiration to token payload as a UTC timestamp
+    to_encode.update({"exp": calendar.timegm(expire.utctimetuple())})
 
     # Encode and return JWT token
+    if JWT_FAST_PATH and to_encode.keys() <= _FAST_PATH_CLAIMS:
+        return _encode_hs256(to_encode)
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -92,20 +262,41 @@ def decode_token(token: str) -> dict:
     Returns: Decoded token payload
     Raises: HTTPException if token is invalid
     """
+    key = hashlib.sha256(token.encode()).hexdigest()[:32]
+
+    # Return cached payload if the token was verified recently and is still valid
+    with _jwt_cache_lock:
+        cached = _jwt_cache.get(key)
+    if cached is not None:
+        payload, exp_ts = cached
+        if time.time() < exp_ts:
+            return payload
+        with _jwt_cache_lock:
+            _jwt_cache.pop(key, None)
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
-    except JWTError:
+        payload = _decode_hs256(token) if JWT_FAST_PATH else None
+        if payload is None:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid or expired token",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    # Only successfully verified tokens are cached
+    exp_ts = payload.get("exp")
+    if exp_ts is not None:
+        with _jwt_cache_lock:
+            _jwt_cache[key] = (payload, exp_ts)
+
+    return payload
+
 
-def get_current_user(
+async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> User:
     """
     Dependency to get current authenticated user from JWT token
@@ -118,7 +309,7 @@ def get_current_user(
     # Extract token from credentials
     token = credentials.credentials
 
-    # Decode token and get user email
+    # Decode token and get user email (plus user id for newer tokens)
     payload = decode_token(token)
     email: str = payload.get("sub")
 
@@ -129,8 +320,21 @@ def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    # Get user from database
-    user = db.query(User).filter(User.email == email).first()
+    # Serve from cache as a detached User (routes only read id/email/name)
+    with _user_cache_lock:
+        cached = _user_cache.get(email)
+    if cached is not None:
+        user_id, user_email, user_name = cached
+        return User(id=user_id, email=user_email, name=user_name)
+
+    # Get user from database, by primary key when the token carries the user id
+    user_id = payload.get("uid")
+    if user_id is not None:
+        user = await db.get(User, user_id)
+        if user is not None and user.email != email:
+            user = None
+    else:
+        user = (await db.scalars(SEL_USER_BY_EMAIL, {"email": email})).first()
 
     if user is None:
         raise HTTPException(
@@ -139,4 +343,17 @@ def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    with _user_cache_lock:
+        _user_cache[email] = (user.id, user.email, user.name)
+
     return user
+
+
+def invalidate_user_cache(email: str) -> None:
+    """
+    Drop a cached user entry
+    Args:
+        email: Email of the user whose cached data is stale
+    """
+    with _user_cache_lock:
+        _user_cache.pop(email, None)
@@ -1,84 +1,236 @@
 """
 Background job scheduler for processing orders
-Runs every 2-3 minutes to process pending orders
+Processes pending orders as soon as their grace period ends, driven by
+PostgreSQL LISTEN/NOTIFY in a single leader process, with a periodic
+safety-net run
 """
 
-from apscheduler.schedulers.background import BackgroundScheduler
+from sqlalchemy import func, select, update
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import Session
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Optional
+import asyncio
 import logging
+import anyio
+import asyncpg
 
-from database import SessionLocal
-from models import Order, OrderStatus
+from config import settings
+from database import DATABASE_URL, SessionLocal
+from models import Order, OrderStatus, NEW_ORDER_CHANNEL
 
 # Setup logging for background jobs
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def process_pending_orders():
+# Maximum number of orders claimed per transaction
+BATCH_SIZE = settings.order_batch_size
+
+# New orders stay pending (and cancellable) for at least this long
+PENDING_GRACE = timedelta(seconds=settings.order_grace_seconds)
+
+# Notifications arriving within this window are handled by a single run
+COALESCE_SECONDS = 0.1
+
+# Safety-net run interval in case a notification is missed (10 minutes)
+SAFETY_INTERVAL_SECONDS = 600
+
+# Wait before retrying after the listener connection fails, and between
+# attempts to take over the leader lock
+RECONNECT_SECONDS = 30
+
+# Session-level advisory lock held by the one process running the listener
+LISTENER_LOCK_KEY = 727002
+
+# Plain libpq-style DSN for the dedicated asyncpg listener connection
+LISTEN_DSN = make_url(DATABASE_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+
+# Creation time of the oldest order still pending, with the database's own
+# clock so the delay is immune to skew between app and database hosts
+_SEL_OLDEST_PENDING = select(func.min(Order.created_at), func.now()).where(Order.status == OrderStatus.PENDING)
+
+def process_pending_orders() -> Optional[float]:
     """
     Background job to process pending orders
-    - Runs every 2-3 minutes
-    - Finds all orders with 'pending' status
-    - Updates them to 'processing' then 'completed'
+    - Runs when pending orders become due (and periodically as a safety net)
+    - Marks orders with 'pending' status as 'completed' in batches
+      of up to BATCH_SIZE rows (oldest first), one transaction per batch
+    - Orders younger than PENDING_GRACE are left pending so they can
+      still be cancelled
+    - Rows locked by another worker are skipped, so several schedulers
+      can run side by side without processing the same order twice
     - Logs all processed orders
+    Returns: Seconds until the oldest remaining pending order leaves its
+             grace period, None if no orders are pending
     """
-    # Create a new database session for this job
+    # Create a new database session for this run; its connection comes from
+    # the sync engine's single-connection pool, which stays open between runs
     db: Session = SessionLocal()
     
+    # Only orders past their grace period are claimable
+    claimable = [Order.status == OrderStatus.PENDING]
+    if PENDING_GRACE:
+        claimable.append(Order.created_at <= func.now() - PENDING_GRACE)
+    
     try:
-        # Find all pending orders
-        pending_orders = db.query(Order).filter(Order.status == OrderStatus.PENDING).all()
-        
-        if not pending_orders:
-            logger.info(f"[{datetime.utcnow()}] No pending orders to process")
-            return
-        
-        logger.info(f"[{datetime.utcnow()}] Found {len(pending_orders)} pending orders to process")
-        
-        # Process each pending order
-        for order in pending_orders:
-            # Update status to processing
-            order.status = OrderStatus.PROCESSING
-            db.commit()
-            logger.info(f"  → Order #{order.id} ({order.product_name}) - Status: PROCESSING")
+        processed = 0
+        while True:
+            # Lock a batch of pending orders, skipping rows another worker holds
+            batch = (
+                select(Order.id)
+                .where(*claimable)
+                .order_by(Order.created_at)
+                .limit(BATCH_SIZE)
+                .with_for_update(skip_locked=True)
+                .scalar_subquery()
+            )
+            stmt = (
+                update(Order)
+                .where(Order.id.in_(batch))
+                .values(status=OrderStatus.COMPLETED)
+                .returning(Order.id, Order.product_name)
+                .execution_options(synchronize_session=False)
+            )
+            result = db.execute(stmt)
             
-            # Simulate processing time (in production, this would be actual business logic)
-            # Update status to completed
-            order.status = OrderStatus.COMPLETED
+            # Log each completed order in this batch
+            batch_count = 0
+            for order_id, product_name in result:
+                logger.info(f"  ✓ Order #{order_id} ({product_name}) - Status: COMPLETED")
+                batch_count += 1
             db.commit()
-            logger.info(f"  ✓ Order #{order.id} ({order.product_name}) - Status: COMPLETED")
+            
+            processed += batch_count
+            if batch_count < BATCH_SIZE:
+                break
+        
+        if not processed:
+            logger.info(f"[{datetime.utcnow()}] No pending orders to process")
+        else:
+            logger.info(f"[{datetime.utcnow()}] Successfully processed {processed} orders")
         
-        logger.info(f"[{datetime.utcnow()}] Successfully processed {len(pending_orders)} orders")
+        # Work out when the oldest order still in its grace period becomes due
+        oldest, db_now = db.execute(_SEL_OLDEST_PENDING).one()
+        db.commit()
+        if oldest is None:
+            return None
+        return (oldest + PENDING_GRACE - db_now).total_seconds()
         
     except Exception as e:
         logger.error(f"[{datetime.utcnow()}] Error processing orders: {str(e)}")
         db.rollback()
+        # Try again after a pause rather than waiting for the safety net
+        return RECONNECT_SECONDS
     finally:
         # Always close the database session
         db.close()
 
-def start_scheduler():
+async def _connect_listener(wakeup: asyncio.Event) -> Optional[asyncpg.Connection]:
     """
-    Initialize and start the background job scheduler
-    - Runs process_pending_orders every 2 minutes
-    - Scheduler runs in a separate background thread
+    Open the dedicated listener connection if this process can lead
+    - Takes LISTENER_LOCK_KEY so only one process (of all uvicorn workers
+      and hosts) listens and runs the job; the lock is released when the
+      connection closes, letting another process take over
+    Returns: The listening connection, or None if another process leads
+    Raises: Any error establishing the connection
     """
-    scheduler = BackgroundScheduler()
+    conn = await asyncpg.connect(LISTEN_DSN)
+    try:
+        if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", LISTENER_LOCK_KEY):
+            await conn.close()
+            return None
+        await conn.add_listener(NEW_ORDER_CHANNEL, lambda *args: wakeup.set())
+        # Reconnect promptly if the server drops the connection
+        conn.add_termination_listener(lambda *args: wakeup.set())
+    except BaseException:
+        await conn.close()
+        raise
     
-    # Add job to run every 2 minutes (120 seconds)
-    # For 3 minutes, change seconds=120 to seconds=180
-    scheduler.add_job(
-        process_pending_orders,
-        'interval',
-        seconds=120,  # Run every 2 minutes
-        id='process_pending_orders',
-        name='Process pending orders',
-        replace_existing=True
-    )
+    logger.info(f"✓ Leading the order processor - listening for '{NEW_ORDER_CHANNEL}' notifications")
+    return conn
+
+async def _run_job() -> Optional[float]:
+    """
+    Run process_pending_orders in a worker thread so the event loop stays responsive
+    Returns: Seconds until the next pending order is due, None if none are pending
+    """
+    try:
+        return await anyio.to_thread.run_sync(process_pending_orders)
+    except Exception as e:
+        logger.error(f"[{datetime.utcnow()}] Background job failed: {str(e)}")
+        return RECONNECT_SECONDS
+
+async def run_order_listener():
+    """
+    Process pending orders as soon as they leave their grace period
+    - One leader process holds LISTENER_LOCK_KEY; others retry every
+      RECONNECT_SECONDS and stay idle while a leader exists
+    - The leader keeps a single deadline: a NOTIFY on NEW_ORDER_CHANNEL
+      sets it to PENDING_GRACE from now unless an earlier run is already
+      scheduled, and each run reschedules it for the oldest order still
+      pending, so no run sleeps unconditionally
+    - Runs anyway every SAFETY_INTERVAL_SECONDS to pick up missed notifications
+    - Falls back to polling every RECONNECT_SECONDS while the database
+      cannot be reached for the listener connection
+    """
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+    conn = None
+    deadline: Optional[float] = None
     
-    # Start the scheduler
-    scheduler.start()
-    logger.info("✓ Background job scheduler started - Processing orders every 2 minutes")
+    try:
+        while True:
+            if conn is None or conn.is_closed():
+                try:
+                    conn = await _connect_listener(wakeup)
+                except Exception as e:
+                    # Database unreachable for LISTEN: poll instead
+                    logger.error(f"[{datetime.utcnow()}] Order listener connection failed: {str(e)}")
+                    conn = None
+                    await asyncio.sleep(RECONNECT_SECONDS)
+                    await _run_job()
+                    continue
+                
+                if conn is None:
+                    # Another process leads; check again later
+                    await asyncio.sleep(RECONNECT_SECONDS)
+                    continue
+                
+                # New leader: catch up on orders created while nobody was listening
+                wakeup.clear()
+                deadline = loop.time()
+            
+            timeout = SAFETY_INTERVAL_SECONDS if deadline is None else max(0.0, deadline - loop.time())
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=timeout)
+                notified = True
+            except asyncio.TimeoutError:
+                notified = False
+            wakeup.clear()
+            
+            if notified:
+                # A new order (or a dropped connection, handled at the top):
+                # the new order is due after its grace period unless an
+                # earlier run is already scheduled
+                if deadline is None:
+                    deadline = loop.time() + PENDING_GRACE.total_seconds() + COALESCE_SECONDS
+                continue
+            
+            # Deadline reached (or safety interval elapsed): run and reschedule
+            delay = await _run_job()
+            deadline = None if delay is None else loop.time() + max(0.0, delay) + COALESCE_SECONDS
+    finally:
+        if conn is not None and not conn.is_closed():
+            await conn.close()
+
+def start_scheduler() -> asyncio.Task:
+    """
+    Start the background order processor on the running event loop
+    - Processes orders as they leave PENDING_GRACE, or every
+      SAFETY_INTERVAL_SECONDS at most, in whichever process leads
+    - Returns the asyncio task; cancel it to stop the scheduler
+    """
+    task = asyncio.create_task(run_order_listener(), name="process_pending_orders")
+    logger.info(f"✓ Background job scheduler started - Processing orders {PENDING_GRACE.total_seconds():g}s after creation")
     
-    return scheduler
\ No newline at end of file
+    return task
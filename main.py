@@ -4,20 +4,23 @@ Initializes the application, database, and background jobs
 """
 
 from fastapi import FastAPI, Request, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response
 from fastapi.exceptions import RequestValidationError
-from contextlib import asynccontextmanager
+from sqlalchemy.exc import SQLAlchemyError
+from cachetools import TTLCache
+from contextlib import asynccontextmanager, suppress
+import asyncio
+import hashlib
 import logging
-import os
-from dotenv import load_dotenv
+import orjson
+import ssl
 
-from database import init_db
+from config import settings
+from database import init_db, close_db
+from responses import UTCZResponse
 from routes import router
 from background_jobs import start_scheduler
 
-# Load environment variables
-load_dotenv()
-
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -34,20 +37,33 @@ async def lifespan(app: FastAPI):
     """
     # Startup: Initialize database and background jobs
     logger.info("🚀 Starting Order Management API...")
+    
+    # Token cache keys are SHA-256 digests; make sure hashlib is backed by
+    # OpenSSL (which uses SHA-NI / ARMv8 SHA2 instructions when available)
+    # rather than CPython's portable fallback implementation
+    if hashlib.sha256.__name__ != "openssl_sha256":
+        logger.warning("hashlib.sha256 is not OpenSSL-backed; token hashing will be slower")
+    logger.info(f"✓ Crypto backend: {ssl.OPENSSL_VERSION}")
+    
     init_db()
-    start_scheduler()
+    scheduler_task = start_scheduler()
     logger.info("✓ Application startup complete")
     
     yield
     
     # Shutdown: Cleanup resources
     logger.info("🛑 Shutting down application...")
+    scheduler_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await scheduler_task
+    await close_db()
 
 # Create FastAPI application instance
 app = FastAPI(
     title="Order Management API",
     description="Backend API for managing orders with JWT authentication",
     version="1.0.0",
+    default_response_class=UTCZResponse,  # Serialize responses with orjson (UTC as Z)
     lifespan=lifespan
 )
 
@@ -56,6 +72,9 @@ app.include_router(router, tags=["API"])
 
 # ============ Exception Handlers ============
 
+# Error types whose traceback was logged recently (throttles log volume)
+_logged_errors = TTLCache(maxsize=128, ttl=60)
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     """
@@ -69,49 +88,73 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         errors.append(f"{field}: {message}")
     
     logger.warning(f"Validation error: {errors}")
-    return JSONResponse(
+    return UTCZResponse(
         status_code=status.HTTP_400_BAD_REQUEST,
         content={"detail": "Validation error", "errors": errors}
     )
 
-@app.exception_handler(Exception)
-async def general_exception_handler(request: Request, exc: Exception):
+@app.exception_handler(SQLAlchemyError)
+async def database_exception_handler(request: Request, exc: SQLAlchemyError):
     """
-    Handle all unhandled exceptions
+    Handle database errors
     Returns 500 Internal Server Error
+    Full traceback is logged at most once per minute per error type
     """
-    logger.error(f"Unhandled exception: {str(exc)}", exc_info=True)
-    return JSONResponse(
+    error_type = type(exc).__name__
+    if error_type in _logged_errors:
+        logger.error(f"Database error: {error_type}: {str(exc)}")
+    else:
+        _logged_errors[error_type] = True
+        logger.error(f"Database error: {error_type}: {str(exc)}", exc_info=exc)
+    
+    return UTCZResponse(
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
         content={"detail": "Internal server error"}
     )
 
 # ============ Health Check Endpoint ============
 
+# Health response body never changes, so serialize it once at import
+HEALTH_BYTES = orjson.dumps({
+    "status": "healthy",
+    "message": "Order Management API is running",
+    "version": "1.0.0"
+})
+HEALTH_RESPONSE = Response(content=HEALTH_BYTES, media_type="application/json")
+
 @app.get("/", tags=["Health"])
-def health_check():
+async def health_check():
     """
     Health check endpoint
-    Returns API status and version
+    Returns API status and version (pre-built response)
+    - async so probes run on the event loop without a threadpool hop
     """
-    return {
-        "status": "healthy",
-        "message": "Order Management API is running",
-        "version": "1.0.0"
-    }
+    return HEALTH_RESPONSE
 
 # Run application with uvicorn when executed directly
 if __name__ == "__main__":
+    import sys
     import uvicorn
     
-    # Get configuration from environment
-    host = os.getenv("APP_HOST", "0.0.0.0")
-    port = int(os.getenv("APP_PORT", "8000"))
+    # Get configuration from settings
+    host = settings.app_host
+    port = settings.app_port
+    reload = settings.app_reload
     
     # Run the application
-    uvicorn.run(
-        "main:app",
-        host=host,
-        port=port,
-        reload=True  # Enable auto-reload during development
-    )
\ No newline at end of file
+    if reload:
+        # Development: single process with auto-reload
+        uvicorn.run("main:app", host=host, port=port, reload=True)
+    else:
+        # Production: WEB_WORKERS workers (default one per CPU), uvloop event
+        # loop and httptools parser
+        # (uvloop is not available on Windows)
+        uvicorn.run(
+            "main:app",
+            host=host,
+            port=port,
+            workers=settings.worker_count,
+            loop="asyncio" if sys.platform == "win32" else "uvloop",
+            http="httptools",
+            reload=False
+        )
@@ -3,10 +3,10 @@ Database models for Order Management System
 Defines User and Order tables with relationships
 """
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Enum
+from sqlalchemy import Column, Integer, SmallInteger, String, Float, DateTime, ForeignKey, Index, func
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from datetime import datetime
 import enum
 
 # Base class for all models
@@ -19,6 +19,32 @@ class OrderStatus(str, enum.Enum):
     COMPLETED = "completed"
     CANCELLED = "cancelled"
 
+# Compact storage codes for order status
+_STATUS_TO_CODE = {
+    OrderStatus.PENDING: 0,
+    OrderStatus.PROCESSING: 1,
+    OrderStatus.COMPLETED: 2,
+    OrderStatus.CANCELLED: 3,
+}
+_CODE_TO_STATUS = {code: status for status, code in _STATUS_TO_CODE.items()}
+
+class OrderStatusType(TypeDecorator):
+    """
+    Stores OrderStatus as a SMALLINT code instead of a database ENUM
+    Application code and the API keep using the string-valued OrderStatus
+    """
+    impl = SmallInteger
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        return None if value is None else _STATUS_TO_CODE[OrderStatus(value)]
+    
+    def process_literal_param(self, value, dialect):
+        return self.process_bind_param(value, dialect)
+    
+    def process_result_value(self, value, dialect):
+        return None if value is None else _CODE_TO_STATUS[value]
+
 class User(Base):
     """
     User model for authentication and authorization
@@ -34,8 +60,8 @@ class User(Base):
     email = Column(String(100), unique=True, nullable=False, index=True)
     password_hash = Column(String(255), nullable=False)
     
-    # Timestamps
-    created_at = Column(DateTime, default=datetime.utcnow)
+    # Timestamps (filled in by the database)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     
     # Relationship: One user can have many orders
     orders = relationship("Order", back_populates="user", cascade="all, delete-orphan")
@@ -50,19 +76,55 @@ class Order(Base):
     # Primary key
     id = Column(Integer, primary_key=True, index=True)
     
-    # Foreign key to users table
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    # Foreign key to users table (indexed via ix_orders_user_id_desc below)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     
     # Order details
     product_name = Column(String(200), nullable=False)
     amount = Column(Float, nullable=False)
     
-    # Order status with enum constraint
-    status = Column(Enum(OrderStatus), default=OrderStatus.PENDING, nullable=False, index=True)
+    # Order status stored as a SMALLINT code (see OrderStatusType)
+    status = Column(OrderStatusType, default=OrderStatus.PENDING, nullable=False, index=True)
     
-    # Timestamps
-    created_at = Column(DateTime, default=datetime.utcnow, index=True)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Timestamps (filled in by the database)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
     
     # Relationship: Each order belongs to one user
-    user = relationship("User", back_populates="orders")
\ No newline at end of file
+    user = relationship("User", back_populates="orders")
+    
+    __table_args__ = (
+        # Serves "orders for user, newest first" pages as a single index range scan
+        Index("ix_orders_user_id_desc", user_id, id.desc()),
+        # Partial index covering only the rows the background job looks for,
+        # in the order it claims them
+        Index("ix_orders_pending", created_at, postgresql_where=(status == OrderStatus.PENDING)),
+    )
+# Channel notified after orders are inserted (the background job LISTENs on it)
+NEW_ORDER_CHANNEL = "new_order"
+
+# Statement-level AFTER INSERT trigger announcing new orders on NEW_ORDER_CHANNEL,
+# so creating an order needs no extra round-trip for the NOTIFY
+# Applied idempotently by init_db on PostgreSQL; the notification is only
+# delivered once the inserting transaction commits
+ORDER_NOTIFY_DDL = (
+    f"""CREATE OR REPLACE FUNCTION notify_new_order() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('{NEW_ORDER_CHANNEL}', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql""",
+    """DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_trigger
+        WHERE tgname = 'orders_notify_new_order' AND tgrelid = 'orders'::regclass
+    ) THEN
+        CREATE TRIGGER orders_notify_new_order
+            AFTER INSERT ON orders
+            FOR EACH STATEMENT
+            EXECUTE FUNCTION notify_new_order();
+    END IF;
+END
+$$""",
+)
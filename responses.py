@@ -0,0 +1,16 @@
+"""
+Response classes shared by the application
+"""
+
+from fastapi.responses import ORJSONResponse
+import orjson
+
+
+class UTCZResponse(ORJSONResponse):
+    """
+    ORJSONResponse that writes UTC datetimes with a "Z" suffix
+    Matches Pydantic's encoding, so responses built from raw rows and
+    responses validated through a response_model format timestamps alike
+    """
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_UTC_Z)
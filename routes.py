@@ -3,18 +3,26 @@ API Routes for Order Management System
 Defines all API endpoints for authentication and order management
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import bindparam, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
+from typing import Optional
 import logging
 
 from database import get_db
+from responses import UTCZResponse
 from models import User, Order, OrderStatus
 from schemas import (
     UserRegister, UserLogin, Token, UserResponse,
     OrderCreate, OrderResponse, OrderListResponse, MessageResponse
 )
-from auth import hash_password, verify_password, create_access_token, get_current_user, ACCESS_TOKEN_EXPIRE_MINUTES
+from auth import (
+    ahash_password, averify_and_update_password, create_access_token, get_current_user,
+    invalidate_user_cache, ACCESS_TOKEN_EXPIRE_MINUTES, DUMMY_PASSWORD_HASH,
+    SEL_USER_BY_EMAIL
+)
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -23,42 +31,78 @@ logger = logging.getLogger(__name__)
 # Create API router
 router = APIRouter()
 
+# Pre-built statements for the fixed query shapes used below
+# Built once at import so each request only binds parameters
+# (the user-by-email lookup is shared with auth)
+_COUNT_ORDERS_BY_USER = (
+    select(func.count())
+    .select_from(Order)
+    .where(Order.user_id == bindparam("user_id"))
+)
+# One page of a user's orders as plain column rows (no ORM instances),
+# newest first, each row carrying the user's total order count
+# (uncorrelated subquery, evaluated once per query)
+_ORDER_FIELDS = tuple(OrderResponse.model_fields)
+_SEL_ORDERS_PAGE = (
+    select(
+        *(getattr(Order, name) for name in _ORDER_FIELDS),
+        _COUNT_ORDERS_BY_USER.scalar_subquery().label("total")
+    )
+    .where(Order.user_id == bindparam("user_id"))
+    .order_by(Order.id.desc())
+    .limit(bindparam("limit"))
+)
+_SEL_ORDERS_PAGE_AFTER = _SEL_ORDERS_PAGE.where(Order.id < bindparam("cursor"))
+_INS_ORDER = insert(Order).returning(Order.id, Order.amount, Order.created_at, Order.updated_at)
+_SEL_ORDER_STATE_BY_ID = select(Order.user_id, Order.status).where(Order.id == bindparam("order_id"))
+_UPD_CANCEL_ORDER = (
+    update(Order)
+    .where(
+        Order.id == bindparam("order_id"),
+        Order.user_id == bindparam("owner_id"),
+        Order.status == OrderStatus.PENDING
+    )
+    .values(status=OrderStatus.CANCELLED)
+    .returning(Order)
+    .execution_options(synchronize_session=False)
+)
+
 # ============ Authentication Routes ============
 
 @router.post("/auth/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-def register_user(user_data: UserRegister, db: Session = Depends(get_db)):
+async def register_user(user_data: UserRegister, db: AsyncSession = Depends(get_db)):
     """
     Register a new user
-    - Validates email uniqueness
+    - Validates email uniqueness via the users.email unique constraint
     - Hashes password before storing
     - Returns created user information
     """
-    # Check if user already exists
-    existing_user = db.query(User).filter(User.email == user_data.email).first()
-    if existing_user:
-        logger.warning(f"Registration failed: Email {user_data.email} already exists")
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Email already registered"
-        )
-    
     # Create new user with hashed password
     new_user = User(
         name=user_data.name,
         email=user_data.email,
-        password_hash=hash_password(user_data.password)
+        password_hash=await ahash_password(user_data.password)
     )
     
-    # Save to database
+    # Save to database; a duplicate email violates the unique constraint
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        logger.warning(f"Registration failed: Email {user_data.email} already exists")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered"
+        )
+    await db.refresh(new_user)
+    invalidate_user_cache(new_user.email)
     
     logger.info(f"New user registered: {new_user.email}")
     return new_user
 
 @router.post("/auth/login", response_model=Token)
-def login_user(credentials: UserLogin, db: Session = Depends(get_db)):
+async def login_user(credentials: UserLogin, db: AsyncSession = Depends(get_db)):
     """
     Authenticate user and return JWT token
     - Validates email and password
@@ -66,10 +110,13 @@ def login_user(credentials: UserLogin, db: Session = Depends(get_db)):
     - Returns access token
     """
     # Find user by email
-    user = db.query(User).filter(User.email == credentials.email).first()
+    user = (await db.scalars(SEL_USER_BY_EMAIL, {"email": credentials.email})).first()
     
-    # Verify user exists and password is correct
-    if not user or not verify_password(credentials.password, user.password_hash):
+    # Verify password; unknown emails are checked against a dummy hash so
+    # response time does not reveal whether the account exists
+    target_hash = user.password_hash if user else DUMMY_PASSWORD_HASH
+    verified, new_hash = await averify_and_update_password(credentials.password, target_hash)
+    if not user or not verified:
         logger.warning(f"Login failed for email: {credentials.email}")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -77,10 +124,15 @@ def login_user(credentials: UserLogin, db: Session = Depends(get_db)):
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Create JWT token with user email as subject
+    # Store upgraded hash if scheme or cost factor changed since it was created
+    if new_hash:
+        user.password_hash = new_hash
+        await db.commit()
+    
+    # Create JWT token with user email as subject and user id for PK lookups
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.email},
+        data={"sub": user.email, "uid": user.id},
         expires_delta=access_token_expires
     )
     
@@ -94,10 +146,10 @@ def login_user(credentials: UserLogin, db: Session = Depends(get_db)):
 # ============ Order Routes ============
 
 @router.post("/orders", response_model=OrderResponse, status_code=status.HTTP_201_CREATED)
-def create_order(
+async def create_order(
     order_data: OrderCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Create a new order for authenticated user
@@ -105,63 +157,106 @@ def create_order(
     - Order starts with 'pending' status
     - Returns created order information
     """
-    # Create new order associated with current user
-    new_order = Order(
+    # Insert the order and get generated and stored columns back in the same round-trip
+    row = (await db.execute(_INS_ORDER.values(
         user_id=current_user.id,
         product_name=order_data.product_name,
         amount=order_data.amount,
         status=OrderStatus.PENDING
-    )
-    
-    # Save to database
-    db.add(new_order)
-    db.commit()
-    db.refresh(new_order)
+    ))).one()
+    await db.commit()
     
-    logger.info(f"Order created: ID={new_order.id}, User={current_user.email}, Product={order_data.product_name}")
-    return new_order
+    logger.info(f"Order created: ID={row.id}, User={current_user.email}, Product={order_data.product_name}")
+    return OrderResponse(
+        id=row.id,
+        user_id=current_user.id,
+        product_name=order_data.product_name,
+        amount=row.amount,
+        status=OrderStatus.PENDING,
+        created_at=row.created_at,
+        updated_at=row.updated_at
+    )
 
-@router.get("/orders", response_model=OrderListResponse)
-def get_user_orders(
+@router.get(
+    "/orders",
+    response_model=None,
+    responses={status.HTTP_200_OK: {"model": OrderListResponse}}
+)
+async def get_user_orders(
+    limit: int = Query(50, ge=1, le=100, description="Maximum number of orders to return"),
+    cursor: Optional[int] = Query(None, ge=1, description="Return orders with an ID below this value (next_cursor of the previous page)"),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
-    Get all orders for authenticated user
+    Get orders for authenticated user, one page at a time
     - Requires valid JWT token
-    - Returns list of orders with total count
-    - Orders sorted by creation date (newest first)
+    - Returns a page of orders, the user's total order count and
+      the cursor for the next page (null on the last page)
+    - Orders sorted newest first (by ID)
     """
-    # Query all orders for current user
-    orders = db.query(Order)\
-        .filter(Order.user_id == current_user.id)\
-        .order_by(Order.created_at.desc())\
-        .all()
+    # Query one page of orders for current user
+    if cursor is None:
+        rows = (await db.execute(_SEL_ORDERS_PAGE, {"user_id": current_user.id, "limit": limit})).all()
+    else:
+        rows = (await db.execute(
+            _SEL_ORDERS_PAGE_AFTER,
+            {"user_id": current_user.id, "limit": limit, "cursor": cursor}
+        )).all()
     
-    logger.info(f"Orders retrieved: {len(orders)} orders for user {current_user.email}")
-    return {
+    # Rows come straight from the database, so map them to response
+    # dicts directly instead of validating each one through OrderResponse
+    orders = [dict(zip(_ORDER_FIELDS, row)) for row in rows]
+    if rows:
+        total = rows[0].total
+    elif cursor is not None:
+        # Past the last page: rows carry no total, so count directly
+        total = await db.scalar(_COUNT_ORDERS_BY_USER, {"user_id": current_user.id})
+    else:
+        total = 0
+    next_cursor = orders[-1]["id"] if len(orders) == limit else None
+    
+    logger.info(f"Orders retrieved: {len(orders)} of {total} orders for user {current_user.email}")
+    # orjson encodes datetimes and enums natively; bypass FastAPI's
+    # response_model re-validation
+    return UTCZResponse(content={
         "orders": orders,
-        "total": len(orders)
-    }
+        "total": total,
+        "next_cursor": next_cursor
+    })
 
 @router.patch("/orders/{order_id}/cancel", response_model=OrderResponse)
-def cancel_order(
+async def cancel_order(
     order_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Cancel an order if it's still pending
     - Requires valid JWT token
     - User can only cancel their own orders
     - Only 'pending' orders can be cancelled
+    - Happy path is a single UPDATE ... RETURNING round-trip
     - Returns updated order information
     """
-    # Find order by ID
-    order = db.query(Order).filter(Order.id == order_id).first()
+    # Cancel in one statement when the order exists, is ours and is pending
+    order = (await db.scalars(
+        _UPD_CANCEL_ORDER,
+        {"order_id": order_id, "owner_id": current_user.id}
+    )).first()
+    
+    if order is not None:
+        # Build the response before commit expires the RETURNING-loaded attributes
+        response = OrderResponse.model_validate(order)
+        await db.commit()
+        logger.info(f"Order cancelled: ID={order_id}, User={current_user.email}")
+        return response
+    
+    # Nothing was updated: look up the order only to report why
+    existing = (await db.execute(_SEL_ORDER_STATE_BY_ID, {"order_id": order_id})).first()
     
     # Check if order exists
-    if not order:
+    if not existing:
         logger.warning(f"Cancel failed: Order {order_id} not found")
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -169,25 +264,16 @@ def cancel_order(
         )
     
     # Check if order belongs to current user
-    if order.user_id != current_user.id:
+    if existing.user_id != current_user.id:
         logger.warning(f"Cancel failed: User {current_user.email} attempted to cancel order {order_id} of another user")
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You can only cancel your own orders"
         )
     
-    # Check if order is still pending
-    if order.status != OrderStatus.PENDING:
-        logger.warning(f"Cancel failed: Order {order_id} status is {order.status}")
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Cannot cancel order with status: {order.status}"
-        )
-    
-    # Update order status to cancelled
-    order.status = OrderStatus.CANCELLED
-    db.commit()
-    db.refresh(order)
-    
-    logger.info(f"Order cancelled: ID={order_id}, User={current_user.email}")
-    return order
\ No newline at end of file
+    # Otherwise the order is no longer pending
+    logger.warning(f"Cancel failed: Order {order_id} status is {existing.status}")
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"Cannot cancel order with status: {existing.status}"
+    )
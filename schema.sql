@@ -23,7 +23,7 @@ CREATE TABLE users (
     name VARCHAR(100) NOT NULL,
     email VARCHAR(100) NOT NULL UNIQUE,
     password_hash VARCHAR(255) NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
     
     -- Constraints
     CONSTRAINT users_email_check CHECK (email ~* '^[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}$')
@@ -41,9 +41,10 @@ CREATE TABLE orders (
     user_id INTEGER NOT NULL,
     product_name VARCHAR(200) NOT NULL,
     amount NUMERIC(10, 2) NOT NULL,
-    status VARCHAR(20) NOT NULL DEFAULT 'pending',
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Status codes: 0=pending, 1=processing, 2=completed, 3=cancelled
+    status SMALLINT NOT NULL DEFAULT 0,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
     
     -- Foreign key constraint
     CONSTRAINT fk_orders_user FOREIGN KEY (user_id) 
@@ -53,16 +54,20 @@ CREATE TABLE orders (
     
     -- Check constraints
     CONSTRAINT orders_amount_check CHECK (amount > 0),
-    CONSTRAINT orders_status_check CHECK (status IN ('pending', 'processing', 'completed', 'cancelled'))
+    CONSTRAINT orders_status_check CHECK (status BETWEEN 0 AND 3)
 );
 
 -- Create indexes for faster queries
-CREATE INDEX idx_orders_user_id ON orders(user_id);
 CREATE INDEX idx_orders_status ON orders(status);
 CREATE INDEX idx_orders_created_at ON orders(created_at DESC);
 
--- Composite index for common query pattern
+-- Composite indexes for common query patterns
+-- (user_id, id DESC) also covers lookups on user_id alone
 CREATE INDEX idx_orders_user_status ON orders(user_id, status);
+CREATE INDEX ix_orders_user_id_desc ON orders(user_id, id DESC);
+
+-- Partial index for the background job's pending-order scan
+CREATE INDEX ix_orders_pending ON orders(created_at) WHERE status = 0;
 
 -- ============================================
 -- Trigger to auto-update updated_at timestamp
@@ -80,6 +85,23 @@ CREATE TRIGGER update_orders_updated_at
     FOR EACH ROW
     EXECUTE FUNCTION update_updated_at_column();
 
+-- ============================================
+-- Trigger to announce new orders to the background job
+-- (init_db installs it too, including on existing databases)
+-- ============================================
+CREATE OR REPLACE FUNCTION notify_new_order()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('new_order', '');
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER orders_notify_new_order
+    AFTER INSERT ON orders
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_new_order();
+
 -- ============================================
 -- Sample Data (Optional - for testing)
 -- ============================================
@@ -90,16 +112,16 @@ INSERT INTO users (name, email, password_hash) VALUES
 
 -- Insert sample orders
 INSERT INTO orders (user_id, product_name, amount, status) VALUES
-(1, 'Laptop', 999.99, 'pending'),
-(1, 'Mouse', 29.99, 'completed'),
-(1, 'Keyboard', 79.99, 'pending');
+(1, 'Laptop', 999.99, 0),
+(1, 'Mouse', 29.99, 2),
+(1, 'Keyboard', 79.99, 0);
 
 -- ============================================
 -- Useful Queries
 -- ============================================
 
 -- Get all pending orders
--- SELECT * FROM orders WHERE status = 'pending' ORDER BY created_at DESC;
+-- SELECT * FROM orders WHERE status = 0 ORDER BY created_at DESC;
 
 -- Get user's order history
 -- SELECT o.*, u.name as user_name 
@@ -112,6 +134,34 @@ INSERT INTO orders (user_id, product_name, amount, status) VALUES
 -- FROM orders 
 -- GROUP BY status;
 
+-- ============================================
+-- Migration: text/enum status -> SMALLINT codes
+-- (for databases created before status became SMALLINT)
+-- ============================================
+
+-- ALTER TABLE orders DROP CONSTRAINT IF EXISTS orders_status_check;
+-- DROP INDEX IF EXISTS ix_orders_pending;
+-- ALTER TABLE orders ALTER COLUMN status DROP DEFAULT;
+-- ALTER TABLE orders ALTER COLUMN status TYPE SMALLINT USING
+--     CASE lower(status::text)
+--         WHEN 'pending' THEN 0
+--         WHEN 'processing' THEN 1
+--         WHEN 'completed' THEN 2
+--         WHEN 'cancelled' THEN 3
+--     END;
+-- ALTER TABLE orders ALTER COLUMN status SET DEFAULT 0;
+-- ALTER TABLE orders ADD CONSTRAINT orders_status_check CHECK (status BETWEEN 0 AND 3);
+-- CREATE INDEX ix_orders_pending ON orders(created_at) WHERE status = 0;
+-- DROP TYPE IF EXISTS orderstatus;
+
+-- ============================================
+-- Migration: TIMESTAMP -> TIMESTAMPTZ (existing values are UTC)
+-- ============================================
+
+-- ALTER TABLE users ALTER COLUMN created_at TYPE TIMESTAMPTZ USING created_at AT TIME ZONE 'UTC';
+-- ALTER TABLE orders ALTER COLUMN created_at TYPE TIMESTAMPTZ USING created_at AT TIME ZONE 'UTC';
+-- ALTER TABLE orders ALTER COLUMN updated_at TYPE TIMESTAMPTZ USING updated_at AT TIME ZONE 'UTC';
+
 -- ============================================
 -- Cleanup Queries (if needed)
 -- ============================================
@@ -61,6 +61,7 @@ class OrderListResponse(BaseModel):
     """Schema for list of orders response"""
     orders: list[OrderResponse]
     total: int = Field(..., description="Total number of orders")
+    next_cursor: Optional[int] = Field(None, description="Cursor for the next page (null on the last page)")
 
 # ============ Generic Schemas ============
 